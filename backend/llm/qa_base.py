@@ -1,5 +1,4 @@
 import asyncio
-import json
 from typing import AsyncIterable, Awaitable, Optional
 from uuid import UUID
 
@@ -16,6 +15,7 @@ from langchain.prompts.chat import (
 from logger import get_logger
 from models.chats import ChatQuestion
 from models.databases.supabase.chats import CreateChatHistory
+import orjson
 from repository.brain import get_brain_by_id
 from repository.chat import (
     GetChatHistoryOutput,
@@ -156,7 +156,7 @@ class QABaseBrainPicking(BaseBrainPicking):
         CHAT_PROMPT = ChatPromptTemplate.from_messages(messages)
         return CHAT_PROMPT
 
-    def generate_answer(
+    async def generate_answer(
         self, chat_id: UUID, question: ChatQuestion
     ) -> GetChatHistoryOutput:
         transformed_history = format_chat_history(get_chat_history(self.chat_id))
@@ -315,11 +315,13 @@ class QABaseBrainPicking(BaseBrainPicking):
             }
         )
 
+        # Yield bytes so the ASGI layer writes frames to the socket without a
+        # per-token str→bytes encode; the blank line terminates each SSE event.
         async for token in callback.aiter():
             logger.info("Token: %s", token)
             response_tokens.append(token)
             streamed_chat_history.assistant = token
-            yield f"data: {json.dumps(streamed_chat_history.dict())}"
+            yield b"data: " + orjson.dumps(streamed_chat_history.dict()) + b"\n\n"
 
         await run
         assistant = "".join(response_tokens)
@@ -1,27 +1,28 @@
 import asyncio
-import json
-from typing import AsyncIterable, Awaitable, List, Optional
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from typing import AsyncIterable, Awaitable, List, Optional, Tuple
 from uuid import UUID
 from repository.brain import get_brain_by_id
 
 from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
-from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
 from langchain.llms.base import BaseLLM
-from langchain.prompts.chat import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-)
 from logger import get_logger
 from models.chats import ChatQuestion
 from models.databases.supabase.chats import CreateChatHistory
 from models.prompt import Prompt
+import orjson
 from pydantic import BaseModel
 from repository.chat import (
     GetChatHistoryOutput,
     format_chat_history,
     format_history_to_openai_mesages,
     get_chat_history,
+    get_chat_history_since,
     update_chat_history,
     update_message_by_id,
 )
@@ -31,19 +32,144 @@ from llm.utils.get_prompt_to_use_id import get_prompt_to_use_id
 
 logger = get_logger(__name__)
 SYSTEM_MESSAGE = "Your name is a Digital Twin - . You're a helpful assistant. If you don't know the answer, just say that you don't know, don't try to make up an answer."
+# The brain name is spliced into SYSTEM_MESSAGE right after "Digital Twin - ".
+SYS_PREFIX = SYSTEM_MESSAGE[:29]
+SYS_SUFFIX = SYSTEM_MESSAGE[29:]
+
+# Streamed tokens are coalesced into SSE frames of up to STREAM_FLUSH_TOKENS
+# tokens, flushed at least every STREAM_FLUSH_SECONDS. The callback queue
+# holds at most STREAM_QUEUE_MAXSIZE tokens per in-flight stream.
+STREAM_FLUSH_TOKENS = 8
+STREAM_FLUSH_SECONDS = 0.03
+STREAM_QUEUE_MAXSIZE = 64
+
+
+class BoundedAsyncIteratorCallbackHandler(AsyncIteratorCallbackHandler):
+    """AsyncIteratorCallbackHandler whose token queue is bounded.
+
+    The stock handler uses an unbounded queue, so a slow client socket lets
+    tokens pile up in memory for the whole response. Awaiting the put here
+    backpressures the LLM callback until the consumer catches up, capping
+    per-stream memory at STREAM_QUEUE_MAXSIZE tokens.
+    """
+
+    def __init__(self, maxsize: int = STREAM_QUEUE_MAXSIZE) -> None:
+        super().__init__()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if token is not None and token != "":
+            await self.queue.put(token)
+
+# LangChain's verbose mode writes to stdout for every LLM event (every token
+# when streaming); keep it off unless explicitly enabled for local debugging.
+_LLM_VERBOSE = os.getenv("LLM_VERBOSE") == "1"
+
+# ChatOpenAI instances are pooled across requests: the constructor sets up an
+# HTTP client and tiktoken encoding, which is wasted work when repeated per
+# call. Keyed by a hash of the API key so the key itself is never a dict key.
+_llm_pool: dict = {}
+_LLM_POOL_MAX = 16
+
+# Fire-and-forget DB writes keep a strong reference here so the event loop
+# does not garbage-collect them before they finish.
+_pending_writes: set = set()
+
+
+def _persist_streamed_answer(message_id: str, user_message: str, assistant: str):
+    """Write the full streamed answer with one retry; runs off the stream."""
+    try:
+        update_message_by_id(
+            message_id=message_id,
+            user_message=user_message,
+            assistant=assistant,
+        )
+    except Exception:
+        logger.exception("Retrying failed answer write for message %s", message_id)
+        update_message_by_id(
+            message_id=message_id,
+            user_message=user_message,
+            assistant=assistant,
+        )
 
-class StringModifier:
-    def __init__(self, default_prompt):
-        self.default_prompt = default_prompt
 
-    def add_string_at_index(self, additional_string, index):
-        first_part = self.default_prompt[:index]
-        second_part = self.default_prompt[index:]
-        prompt_content = first_part + additional_string + second_part
-        return prompt_content
+def _reap_write(task: asyncio.Task) -> None:
+    # Always retrieve the task's exception: a backgrounded write that failed
+    # both attempts must be logged, not dropped at garbage collection.
+    _pending_writes.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error("Dropped streamed answer write: %s", exc)
+
+# Formatted chat history per chat_id. Between consecutive turns almost all of
+# a chat's history is unchanged, so cache the formatted (human, ai) tuples and
+# only fetch/format rows newer than the cached high-water mark. Keeping the
+# prefix byte-stable across turns also helps provider-side prompt caching.
+_history_cache: dict = {}
+_HISTORY_CACHE_MAX = 128
+
+
+def _formatted_history_for(chat_id) -> List[Tuple[str, str]]:
+    cached = _history_cache.get(chat_id)
+    if cached is None:
+        cached_formatted: List[Tuple[str, str]] = []
+        rows = get_chat_history(chat_id)
+    else:
+        last_time, cached_formatted = cached
+        rows = get_chat_history_since(chat_id, last_time)
+    new_formatted = format_chat_history(rows)
+    formatted = cached_formatted + new_formatted
+
+    # A row with an empty assistant is usually a turn whose final answer is
+    # still being persisted in the background. Never advance the high-water
+    # mark past it: update_message_by_id does not touch message_time, so a
+    # cached empty answer would otherwise stay blank for the process lifetime.
+    cacheable = 0
+    for row in rows:
+        if row.assistant == "":
+            break
+        cacheable += 1
+
+    if cacheable:
+        if cached is None and len(_history_cache) >= _HISTORY_CACHE_MAX:
+            _history_cache.pop(next(iter(_history_cache)))
+        _history_cache[chat_id] = (
+            rows[cacheable - 1].message_time,
+            cached_formatted + new_formatted[:cacheable],
+        )
+    return formatted
+
+
+def _pooled_llm(model, temperature, streaming, openai_api_key) -> ChatOpenAI:
+    key = (
+        model,
+        temperature,
+        streaming,
+        hashlib.sha256((openai_api_key or "").encode()).hexdigest(),
+    )
+    llm = _llm_pool.get(key)
+    if llm is None:
+        if len(_llm_pool) >= _LLM_POOL_MAX:
+            _llm_pool.pop(next(iter(_llm_pool)))
+        llm = _llm_pool[key] = ChatOpenAI(
+            temperature=temperature,
+            model=model,
+            streaming=streaming,
+            verbose=_LLM_VERBOSE,
+            openai_api_key=openai_api_key,
+        )  # pyright: ignore reportPrivateUsage=none
+    return llm
+
+@dataclass(slots=True)
+class PreparedCall:
+    """Request inputs shared by generate_answer and generate_stream."""
+
+    messages: list
+    prompt_id: Optional[UUID]
+    prompt_title: Optional[str]
 
-    def modify_default_prompt(self, new_prompt):
-        self.default_prompt = new_prompt
 
 class HeadlessQA(BaseModel):
     model: str = None  # type: ignore
@@ -89,171 +215,203 @@ class HeadlessQA(BaseModel):
             self.streaming
         )  # pyright: ignore reportPrivateUsage=none
 
-    @property
+    @cached_property
     def prompt_to_use(self) -> Optional[Prompt]:
+        # prompt_id is set at init time, so the resolved prompt is stable for
+        # the lifetime of the instance and only needs one lookup.
         return get_prompt_to_use(None, self.prompt_id)
 
-    @property
+    @cached_property
     def prompt_to_use_id(self) -> Optional[UUID]:
         return get_prompt_to_use_id(None, self.prompt_id)
 
-    def _create_llm(
-        self, model, temperature=0, streaming=False, callbacks=None
-    ) -> BaseLLM:
+    def _create_llm(self, model, temperature=0, streaming=False) -> BaseLLM:
         """
         Determine the language model to be used.
         :param model: Language model name to be used.
         :param streaming: Whether to enable streaming of the model
-        :param callbacks: Callbacks to be used for streaming
-        :return: Language model instance
+        :return: Language model instance, shared across requests. Per-request
+            callbacks must be passed at call time, never bound to the instance.
         """
-        return ChatOpenAI(
-            temperature=temperature,
-            model=model,
-            streaming=streaming,
-            verbose=True,
-            callbacks=callbacks,
-            openai_api_key=self.openai_api_key,
-        )  # pyright: ignore reportPrivateUsage=none
-
-    def _create_prompt_template(self):
-        messages = [
-            HumanMessagePromptTemplate.from_template("{question}"),
-        ]
-        CHAT_PROMPT = ChatPromptTemplate.from_messages(messages)
-        return CHAT_PROMPT
-
-    def generate_answer(
-        self, chat_id: UUID, question: ChatQuestion
-    ) -> GetChatHistoryOutput:
-        transformed_history = format_chat_history(get_chat_history(self.chat_id))
-
-        modifier = StringModifier(SYSTEM_MESSAGE)
-        brain = get_brain_by_id(self.brain_id)
+        return _pooled_llm(model, temperature, streaming, self.openai_api_key)
+
+    async def _prepare(self, question: ChatQuestion) -> PreparedCall:
+        """Resolve everything both answer paths need before calling the LLM."""
+        # The history and brain fetches are independent round-trips, so run
+        # them concurrently instead of serially on the critical path.
+        transformed_history, brain = await asyncio.gather(
+            asyncio.to_thread(_formatted_history_for, self.chat_id),
+            asyncio.to_thread(get_brain_by_id, self.brain_id),
+        )
 
         prompt_content = (
-            self.prompt_to_use.content if self.prompt_to_use else modifier.add_string_at_index(brain.name, 29)
+            self.prompt_to_use.content
+            if self.prompt_to_use
+            else f"{SYS_PREFIX}{brain.name}{SYS_SUFFIX}"
         )
 
         messages = format_history_to_openai_mesages(
             transformed_history, prompt_content, question.question
         )
-        answering_llm = self._create_llm(
-            model=self.model, streaming=False, callbacks=self.callbacks
+        return PreparedCall(
+            messages=messages,
+            prompt_id=self.prompt_to_use_id,
+            prompt_title=self.prompt_to_use.title if self.prompt_to_use else None,
         )
+
+    async def generate_answer(
+        self, chat_id: UUID, question: ChatQuestion
+    ) -> GetChatHistoryOutput:
+        prepared = await self._prepare(question)
+        answering_llm = self._create_llm(model=self.model, streaming=False)
         model_prediction = answering_llm.predict_messages(
-            messages  # pyright: ignore reportPrivateUsage=none
+            prepared.messages,  # pyright: ignore reportPrivateUsage=none
+            callbacks=self.callbacks,
         )
         answer = model_prediction.content
 
+        # These models are built from values our own code already validated,
+        # so skip pydantic validation and the temporary kwargs dict.
         new_chat = update_chat_history(
-            CreateChatHistory(
-                **{
-                    "chat_id": chat_id,
-                    "user_message": question.question,
-                    "assistant": answer,
-                    "brain_id": None,
-                    "prompt_id": self.prompt_to_use_id,
-                }
+            CreateChatHistory.construct(
+                chat_id=chat_id,
+                user_message=question.question,
+                assistant=answer,
+                brain_id=None,
+                prompt_id=prepared.prompt_id,
             )
         )
 
-        return GetChatHistoryOutput(
-            **{
-                "chat_id": chat_id,
-                "user_message": question.question,
-                "assistant": answer,
-                "message_time": new_chat.message_time,
-                "prompt_title": self.prompt_to_use.title
-                if self.prompt_to_use
-                else None,
-                "brain_name": None,
-                "message_id": new_chat.message_id,
-            }
+        return GetChatHistoryOutput.construct(
+            chat_id=chat_id,
+            user_message=question.question,
+            assistant=answer,
+            message_time=new_chat.message_time,
+            prompt_title=prepared.prompt_title,
+            brain_name=None,
+            message_id=new_chat.message_id,
         )
 
     async def generate_stream(
         self, chat_id: UUID, question: ChatQuestion
     ) -> AsyncIterable:
-        callback = AsyncIteratorCallbackHandler()
+        callback = BoundedAsyncIteratorCallbackHandler()
         self.callbacks = [callback]
 
-        transformed_history = format_chat_history(get_chat_history(self.chat_id))
-
-        modifier = StringModifier(SYSTEM_MESSAGE)
-        brain = get_brain_by_id(self.brain_id)
-
-        prompt_content = (
-            self.prompt_to_use.content if self.prompt_to_use else modifier.add_string_at_index(brain.name, 29)
-        )
-
-        messages = format_history_to_openai_mesages(
-            transformed_history, prompt_content, question.question
-        )
-        answering_llm = self._create_llm(
-            model=self.model, streaming=True, callbacks=self.callbacks
-        )
-
-        CHAT_PROMPT = ChatPromptTemplate.from_messages(messages)
-        headlessChain = LLMChain(llm=answering_llm, prompt=CHAT_PROMPT)
+        prepared = await self._prepare(question)
+        answering_llm = self._create_llm(model=self.model, streaming=True)
 
         response_tokens = []
 
         async def wrap_done(fn: Awaitable, event: asyncio.Event):
             try:
                 await fn
+            except asyncio.CancelledError:
+                # Expected when the client disconnects mid-stream.
+                raise
             except Exception as e:
                 logger.error(f"Caught exception: {e}")
             finally:
                 event.set()
 
+        # The messages are already fully formatted, so call the model
+        # directly instead of routing through a no-op prompt template/chain.
         run = asyncio.create_task(
             wrap_done(
-                headlessChain.acall({}),
+                answering_llm.agenerate([prepared.messages], callbacks=[callback]),
                 callback.done,
             ),
         )
 
-        streamed_chat_history = update_chat_history(
-            CreateChatHistory(
-                **{
-                    "chat_id": chat_id,
-                    "user_message": question.question,
-                    "assistant": "",
-                    "brain_id": None,
-                    "prompt_id": self.prompt_to_use_id,
-                }
+        try:
+            # Fire the initial history INSERT while the LLM is prefilling;
+            # the row is only needed (message_id/message_time) before the
+            # first yield.
+            insert_task = asyncio.create_task(
+                asyncio.to_thread(
+                    update_chat_history,
+                    CreateChatHistory.construct(
+                        chat_id=chat_id,
+                        user_message=question.question,
+                        assistant="",
+                        brain_id=None,
+                        prompt_id=prepared.prompt_id,
+                    ),
+                )
             )
-        )
 
-        streamed_chat_history = GetChatHistoryOutput(
-            **{
-                "chat_id": str(chat_id),
-                "message_id": streamed_chat_history.message_id,
-                "message_time": streamed_chat_history.message_time,
-                "user_message": question.question,
-                "assistant": "",
-                "prompt_title": self.prompt_to_use.title
-                if self.prompt_to_use
-                else None,
-                "brain_name": None,
-            }
-        )
+            streamed_chat_history = await insert_task
 
-        async for token in callback.aiter():
-            logger.info("Token: %s", token)
-            response_tokens.append(token)
-            streamed_chat_history.assistant = token
-            yield f"data: {json.dumps(streamed_chat_history.dict())}"
+            streamed_chat_history = GetChatHistoryOutput.construct(
+                chat_id=str(chat_id),
+                message_id=streamed_chat_history.message_id,
+                message_time=streamed_chat_history.message_time,
+                user_message=question.question,
+                assistant="",
+                prompt_title=prepared.prompt_title,
+                brain_name=None,
+            )
+
+            # Every field of the frame except `assistant` is invariant across
+            # the stream, so serialize them once and only encode the delta per
+            # frame. Frames are built and yielded as bytes so the ASGI layer
+            # writes them to the socket without re-encoding.
+            frame_base = streamed_chat_history.dict()
+            frame_base.pop("assistant")
+            frame_prefix = (
+                b'data: ' + orjson.dumps(frame_base)[:-1] + b',"assistant":'
+            )
 
-        await run
+            # Coalesce tokens into small windows so the serialization and
+            # yield cost is paid once per frame instead of once per token.
+            # Each frame carries the delta since the last flush, which is what
+            # the client appends; tokens are kept in a single list and joined
+            # per window, so no cumulative string is ever rebuilt during the
+            # stream.
+            flushed = 0
+            last_flush = time.monotonic()
+
+            async for token in callback.aiter():
+                logger.debug("Token: %s", token)
+                response_tokens.append(token)
+                now = time.monotonic()
+                if (
+                    len(response_tokens) - flushed >= STREAM_FLUSH_TOKENS
+                    or now - last_flush > STREAM_FLUSH_SECONDS
+                ):
+                    delta = "".join(response_tokens[flushed:])
+                    yield frame_prefix + orjson.dumps(delta) + b"}\n\n"
+                    flushed = len(response_tokens)
+                    last_flush = now
+
+            if flushed < len(response_tokens):
+                delta = "".join(response_tokens[flushed:])
+                yield frame_prefix + orjson.dumps(delta) + b"}\n\n"
+
+            await run
+        finally:
+            # Reached when the client disconnects mid-loop, but also when the
+            # history insert above raises: cancel the LLM call so it stops
+            # consuming tokens (and money) for a stream nobody is reading and
+            # does not block forever on the bounded token queue.
+            if not run.done():
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
         assistant = "".join(response_tokens)
 
-        update_message_by_id(
-            message_id=str(streamed_chat_history.message_id),
-            user_message=question.question,
-            assistant=assistant,
+        # The client has already seen every token; persist the full answer in
+        # the background so closing the stream does not wait on the DB.
+        write_task = asyncio.create_task(
+            asyncio.to_thread(
+                _persist_streamed_answer,
+                str(streamed_chat_history.message_id),
+                question.question,
+                assistant,
+            )
         )
+        _pending_writes.add(write_task)
+        write_task.add_done_callback(_reap_write)
 
     class Config:
         arbitrary_types_allowed = True
+        keep_untouched = (cached_property,)
@@ -146,6 +146,10 @@ class Repository(ABC):
     def get_chat_history(self, chat_id: str):
         pass
 
+    @abstractmethod
+    def get_chat_history_since(self, chat_id: str, message_time: str):
+        pass
+
     @abstractmethod
     def get_user_chats(self, user_id: str):
         pass
@@ -41,6 +41,18 @@ class Chats(Repository):
 
         return reponse
 
+    def get_chat_history_since(self, chat_id: str, message_time: str):
+        response = (
+            self.db.from_("chat_history")
+            .select("*")
+            .filter("chat_id", "eq", chat_id)
+            .filter("message_time", "gt", message_time)
+            .order("message_time", desc=False)
+            .execute()
+        )
+
+        return response
+
     def get_user_chats(self, user_id: str):
         response = (
             self.db.from_("chats")
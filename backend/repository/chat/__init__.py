@@ -2,7 +2,11 @@ from .create_chat import create_chat, CreateChatProperties
 from .update_chat import update_chat, ChatUpdatableProperties
 from .get_user_chats import get_user_chats
 from .get_chat_by_id import get_chat_by_id
-from .get_chat_history import GetChatHistoryOutput, get_chat_history
+from .get_chat_history import (
+    GetChatHistoryOutput,
+    get_chat_history,
+    get_chat_history_since,
+)
 from .update_chat_history import update_chat_history
 from .update_message_by_id import update_message_by_id
 from .format_chat_history import format_history_to_openai_mesages
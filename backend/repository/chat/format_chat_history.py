@@ -1,3 +1,4 @@
+from itertools import chain
 from typing import List, Tuple
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
@@ -10,10 +11,14 @@ def format_chat_history(history) -> List[Tuple[str, str]]:
 
 def format_history_to_openai_mesages(tuple_history: List[Tuple[str, str]], system_message: str, question: str) -> List[SystemMessage | HumanMessage | AIMessage]:
     """Format the chat history into a list of Base Messages"""
-    messages = []
-    messages.append(SystemMessage(content=system_message))
-    for human, ai in tuple_history:
-        messages.append(HumanMessage(content=human))
-        messages.append(AIMessage(content=ai))
+    messages: List[SystemMessage | HumanMessage | AIMessage] = [
+        SystemMessage(content=system_message)
+    ]
+    messages.extend(
+        chain.from_iterable(
+            (HumanMessage(content=human), AIMessage(content=ai))
+            for human, ai in tuple_history
+        )
+    )
     messages.append(HumanMessage(content=question))
     return messages
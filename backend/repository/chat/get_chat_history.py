@@ -25,9 +25,7 @@ class GetChatHistoryOutput(BaseModel):
         return chat_history
 
 
-def get_chat_history(chat_id: str) -> List[GetChatHistoryOutput]:
-    supabase_db = get_supabase_db()
-    history: List[dict] = supabase_db.get_chat_history(chat_id).data
+def _enrich_history(history: Optional[List[dict]]) -> List[GetChatHistoryOutput]:
     if history is None:
         return []
     else:
@@ -54,3 +52,18 @@ def get_chat_history(chat_id: str) -> List[GetChatHistoryOutput]:
                 )
             )
         return enriched_history
+
+
+def get_chat_history(chat_id: str) -> List[GetChatHistoryOutput]:
+    supabase_db = get_supabase_db()
+    history: List[dict] = supabase_db.get_chat_history(chat_id).data
+    return _enrich_history(history)
+
+
+def get_chat_history_since(
+    chat_id: str, message_time: str
+) -> List[GetChatHistoryOutput]:
+    """Messages of a chat strictly newer than the given message_time."""
+    supabase_db = get_supabase_db()
+    history: List[dict] = supabase_db.get_chat_history_since(chat_id, message_time).data
+    return _enrich_history(history)
@@ -239,7 +239,7 @@ async def create_question_handler(
                 prompt_id=chat_question.prompt_id,
             )
 
-        chat_answer = gpt_answer_generator.generate_answer(chat_id, chat_question)
+        chat_answer = await gpt_answer_generator.generate_answer(chat_id, chat_question)
 
         return chat_answer
     except HTTPException as e:
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+from llm import qa_headless
+
+
+def _row(message_time, user_message, assistant):
+    return SimpleNamespace(
+        user_message=user_message,
+        assistant=assistant,
+        message_time=message_time,
+    )
+
+
+def test_formatted_history_is_fetched_incrementally(monkeypatch):
+    qa_headless._history_cache.clear()
+    calls = []
+
+    def fake_full(chat_id):
+        calls.append(("full", chat_id))
+        return [_row("t1", "q1", "a1")]
+
+    def fake_since(chat_id, message_time):
+        calls.append(("since", message_time))
+        return [_row("t2", "q2", "a2")]
+
+    monkeypatch.setattr(qa_headless, "get_chat_history", fake_full)
+    monkeypatch.setattr(qa_headless, "get_chat_history_since", fake_since)
+
+    # First turn does a full fetch, the next one only fetches newer rows
+    assert qa_headless._formatted_history_for("chat") == [("q1", "a1")]
+    assert qa_headless._formatted_history_for("chat") == [
+        ("q1", "a1"),
+        ("q2", "a2"),
+    ]
+    assert calls == [("full", "chat"), ("since", "t1")]
+
+
+def test_empty_assistant_rows_are_refetched_next_turn(monkeypatch):
+    # The row of an in-flight turn is inserted with assistant="" and only
+    # completed by a background write that does not change message_time. The
+    # cache must not advance its high-water mark past such a row, otherwise
+    # the blank answer would never be re-read.
+    qa_headless._history_cache.clear()
+    since_times = []
+
+    def fake_full(chat_id):
+        return [_row("t1", "q1", "a1"), _row("t2", "q2", "")]
+
+    def fake_since(chat_id, message_time):
+        since_times.append(message_time)
+        return [_row("t2", "q2", "a2"), _row("t3", "q3", "")]
+
+    monkeypatch.setattr(qa_headless, "get_chat_history", fake_full)
+    monkeypatch.setattr(qa_headless, "get_chat_history_since", fake_since)
+
+    assert qa_headless._formatted_history_for("chat") == [
+        ("q1", "a1"),
+        ("q2", ""),
+    ]
+    # The next turn refetches from t1 and picks up the completed answer
+    assert qa_headless._formatted_history_for("chat") == [
+        ("q1", "a1"),
+        ("q2", "a2"),
+        ("q3", ""),
+    ]
+    assert since_times == ["t1"]